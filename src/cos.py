@@ -1,5 +1,16 @@
+import requests
 from loguru import logger as log
 from qcloud_cos import CosConfig, CosS3Client, CosServiceError
+from requests.adapters import HTTPAdapter, Retry
+
+POOL_CONNECTIONS = 64  # 连接池缓存的主机数
+POOL_MAXSIZE = 128  # 每个主机的最大连接数，需大于批量操作的并发线程数
+# 重试分工: SDK负责所有请求的连接异常和5xx重试(可回退上传的文件流)，与SDK默认值一致;
+# HTTP层只对GET/HEAD/DELETE的429/5xx响应再做一次指数退避重试。单次调用最多请求次数:
+#   PUT/POST及连接异常: SDK_RETRY + 1 = 4 次
+#   GET/HEAD/DELETE的429/5xx: (SDK_RETRY + 1) * (HTTP_STATUS_RETRY + 1) = 8 次
+SDK_RETRY = 3
+HTTP_STATUS_RETRY = 1
 
 
 class TencentCos(object):
@@ -13,6 +24,7 @@ class TencentCos(object):
         self.secret_id = secret_id
         self.secret_key = secret_key
         self.region = region
+        self._session = self._create_session()
         self.client = self.connect_client()
         self._bucket_suffix = self.get_appid()
 
@@ -21,7 +33,29 @@ class TencentCos(object):
         cos_region = self.region if region is None else region
         cos_config = CosConfig(SecretId=self.secret_id, SecretKey=self.secret_key,
                                Region=cos_region, Token=None, Scheme='https')
-        return CosS3Client(cos_config)
+        return CosS3Client(cos_config, retry=SDK_RETRY, session=self._session)
+
+    @staticmethod
+    def _create_session():
+        """创建所有客户端共用的HTTP会话，扩大连接池并对幂等请求指数退避重试"""
+        # 连接/读取异常交给SDK重试; 重试耗尽时返回最后一次响应而非抛出RetryError，
+        # 以便SDK正常构造CosServiceError
+        retry = Retry(total=HTTP_STATUS_RETRY, connect=0, read=0, other=0,
+                      status=HTTP_STATUS_RETRY, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=frozenset(['GET', 'HEAD', 'DELETE']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                              pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def set_region(self, region: str):
+        """切换COS地区，仅重建客户端，不重新获取APPID"""
+        self.region = region
+        self.client = self.connect_client()
 
     def get_appid(self):
         """获取cos的APPID"""
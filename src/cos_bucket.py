@@ -1,7 +1,12 @@
+import base64
 import hashlib
 import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
 from functools import partial
-from pathlib import Path
+from itertools import islice
 from traceback import format_exc
 from urllib.parse import quote
 
@@ -9,9 +14,17 @@ from loguru import logger as log
 from qcloud_cos import CosServiceError
 
 from .cos import TencentCos
-from .exceptions import CosBucketDirNotFoundError
+from .exceptions import CosBucketDirNotFoundError, CosBucketNotFoundError
 
-REGIONS = ['nanjing', 'chengdu', 'beijing', 'guangzhou', 'shanghai', 'chongqing', 'hongkong']
+MD5_CHUNK_SIZE = 1 << 20  # 计算本地文件MD5时每次读取1MiB
+DELETE_BATCH_SIZE = 1000  # 批量删除接口单次最多1000个对象
+DEFAULT_WORKERS = 32  # 批量上传/下载/查询时的默认并发线程数，批量模式下大文件分块串行传输
+DIRCACHE_TTL = 5.0  # 列举结果缓存有效期(秒)
+MULTIPART_PART_SIZE = 8  # 分块上传/下载的分块大小(MB)
+# 超过一个分块大小的文件使用分块并发上传; SDK的upload_file对不超过PartSize的文件
+# 会退回put_object(EnableMD5=True)并再次完整读取文件计算MD5，因此阈值需与分块大小一致
+MULTIPART_THRESHOLD = MULTIPART_PART_SIZE * 1024 * 1024
+MULTIPART_THREADS = 10  # 分块上传/下载并发线程数
 
 
 class TencentCosBucket(object):
@@ -20,9 +33,11 @@ class TencentCosBucket(object):
     def __init__(self, cos: TencentCos, bucket_name: str):
         self.cos = cos
         self.name = bucket_name
-        self.full_name = bucket_name + '-' + self.cos.get_appid()
-        self.base_url = self._get_bucket_url()
+        self.full_name = bucket_name + '-' + self.cos._bucket_suffix
         self.region = self._get_correct_cos_region()
+        self.base_url = self._get_bucket_url()
+        self._quote = partial(quote, safe='/')
+        self._dircache = {}  # (prefix, delimiter) -> (缓存时间, 列举结果)
 
     # **********************************************************************
     # Protect methods, for internal usage only
@@ -33,58 +48,117 @@ class TencentCosBucket(object):
         return 'https://' + self.full_name + '.cos.' + self.cos.region + '.myqcloud.com/'
 
     def _get_correct_cos_region(self):
-        """获取存储桶的正确地区配置"""
-        for region in REGIONS:
-            try:
-                self.cos.client.list_objects(Bucket=self.full_name)
-                return region
-            except CosServiceError as e:
-                if e.get_error_code() == 'NoSuchBucket':
-                    log.warning(f'bucket {self.name} not in region '
-                                f'{self.cos.region}, now try another region...')
-                    region = f'ap-{region}'
-                    self.cos = TencentCos(self.cos.secret_id, self.cos.secret_key, region)
-                    self.full_name = self.name + '-' + self.cos.get_appid()
-                    continue
-            except Exception as e:
-                log.error(f'Fatal: {str(e)}')
+        """获取存储桶的正确地区配置，并在地区不一致时重新连接"""
+        for bucket in self.cos.client.list_buckets()['Buckets']['Bucket']:
+            if bucket['Name'] == self.full_name:
+                region = bucket['Location']
+                break
+        else:
+            raise CosBucketNotFoundError(f'Bucket {self.name} not found.')
+        if region != self.cos.region:
+            log.warning(f'bucket {self.name} not in region {self.cos.region}, '
+                        f'reconnect to region {region}')
+            # 复制后切换地区，不影响调用方持有的TencentCos实例
+            self.cos = copy(self.cos)
+            self.cos.set_region(region)
+        return region
+
+    def _iter_objects(self, prefix: str = ''):
+        """分页遍历远程对象，逐个返回对象的完整路径"""
+        marker = ''
+        while True:
+            response = self.cos.client.list_objects(
+                Bucket=self.full_name, Prefix=prefix, Marker=marker, MaxKeys=1000)
+            yield from (c['Key'] for c in response.get('Contents', []))
+            if response.get('IsTruncated') != 'true':
+                break
+            marker = response['NextMarker']
 
     def _list_objects(self, prefix: str = ''):
-        """列出远程对象/文件"""
-        response = self.cos.client.list_objects(Bucket=self.full_name, Prefix=prefix)
-        if 'Contents' in response:
-            return [c['Key'].replace(prefix, '') for c in response['Contents']]
-        else:
+        """列出远程对象/文件，结果短时缓存"""
+        objects = self._dircache_get(prefix, '')
+        if objects is None:
+            objects = [key[len(prefix):] for key in self._iter_objects(prefix)]
+            self._dircache[(prefix, '')] = (time.monotonic(), objects)
+        if not objects:
             log.warning(f'Cannot find any objects in bucket {self.name}')
-            return []
+        return list(objects)
+
+    def _list_prefixes(self, prefix: str = ''):
+        """列出指定前缀下一级的文件夹前缀，结果短时缓存"""
+        prefixes = self._dircache_get(prefix, '/')
+        if prefixes is not None:
+            return list(prefixes)
+        prefixes, marker = [], ''
+        while True:
+            response = self.cos.client.list_objects(
+                Bucket=self.full_name, Prefix=prefix, Delimiter='/', Marker=marker)
+            prefixes.extend(c['Prefix'] for c in response.get('CommonPrefixes', []))
+            if response.get('IsTruncated') != 'true':
+                break
+            marker = response['NextMarker']
+        self._dircache[(prefix, '/')] = (time.monotonic(), prefixes)
+        return list(prefixes)
+
+    def _dircache_get(self, prefix: str, delimiter: str):
+        """读取未过期的列举缓存，不存在或已过期时返回None"""
+        cached = self._dircache.get((prefix, delimiter))
+        if cached is not None and time.monotonic() - cached[0] < DIRCACHE_TTL:
+            return cached[1]
+        return None
 
     def _upload_object(self, local_file_path: str, remote_dir: str = '', overwrite=True):
         """上传单个对象"""
-        if not os.path.exists(local_file_path):
+        remote_dir_prefix = self._fmt_dir_prefix(remote_dir)
+        result = self._upload_object_fast(local_file_path, remote_dir_prefix, overwrite)
+        if result == (True, 'SUCCESS'):
+            log.success(f'Upload {local_file_path} to {remote_dir_prefix} Success!')
+        return result
+
+    def _upload_object_fast(self, local_file_path: str, remote_dir_prefix: str, overwrite=True,
+                            multipart_threads: int = MULTIPART_THREADS):
+        """上传单个对象，remote_dir_prefix需预先经_fmt_dir_prefix归一化，供批量上传复用"""
+        try:
+            file_size = os.stat(local_file_path).st_size
+        except OSError:
             err_msg = f'local path: {local_file_path} doesnt exists'
             log.error(err_msg)
             return False, err_msg
-        p = Path(local_file_path)
-        file_name = p.name
-
-        if file_name in self._list_objects():
-            if not overwrite:
-                warning_msg = f'{file_name} already in {self.name}, skipped!'
-                log.warning(warning_msg)
-                return True, warning_msg
-            else:
-                log.warning(f'{file_name} already in {self.name}, overwrite!')
+        file_name = os.path.basename(local_file_path)
+        object_key = remote_dir_prefix + file_name
+
+        # 覆盖上传时无需检查目标是否存在，省去一次HEAD请求
+        if not overwrite and self._is_object_exists(object_key):
+            warning_msg = f'{file_name} already in {self.name}, skipped!'
+            log.warning(warning_msg)
+            return True, warning_msg
         try:
-            with open(local_file_path, 'rb') as f:
-                self.cos.client.put_object(
+            # 只计算一次MD5，同时用于Content-MD5校验和x-cos-meta-md5元数据，
+            # 避免EnableMD5=True时SDK再次完整读取文件
+            md5hash = self._local_file_md5(local_file_path)
+            if file_size > MULTIPART_THRESHOLD:
+                # 大文件分块并发上传，EnableMD5对每个分块进行校验
+                self.cos.client.upload_file(
                     Bucket=self.full_name,
-                    Body=f,
-                    Key=os.path.join(remote_dir, file_name),
-                    StorageClass='STANDARD',
+                    Key=object_key,
+                    LocalFilePath=local_file_path,
+                    PartSize=MULTIPART_PART_SIZE,
+                    MAXThread=multipart_threads,
                     EnableMD5=True,
-                    Metadata={'x-cos-meta-md5': self.get_local_file_md5(local_file_path)}
+                    StorageClass='STANDARD',
+                    Metadata={'x-cos-meta-md5': md5hash.hexdigest()}
                 )
-            log.success(f'Upload {local_file_path} to {remote_dir} Success!')
+            else:
+                with open(local_file_path, 'rb') as f:
+                    self.cos.client.put_object(
+                        Bucket=self.full_name,
+                        Body=f,
+                        Key=object_key,
+                        StorageClass='STANDARD',
+                        ContentMD5=base64.b64encode(md5hash.digest()).decode(),
+                        Metadata={'x-cos-meta-md5': md5hash.hexdigest()}
+                    )
+            self.invalidate_cache(object_key)
         except CosServiceError as e:
             return False, e.get_error_code()
         except Exception as e:
@@ -92,35 +166,25 @@ class TencentCosBucket(object):
 
         return True, 'SUCCESS'
 
-    def _download_object(self, remote_file_path: str, local_dir: str):
-        """下载单个对象"""
+    def _download_object(self, remote_file_path: str, local_dir: str,
+                         multipart_threads: int = MULTIPART_THREADS):
+        """下载单个对象，使用SDK的分块Range下载，支持断点续传"""
         file_dir, file_name = self._parse_object_path_name(remote_file_path)
         local_file_path = os.path.join(local_dir, file_name)
         try:
             self.cos.client.download_file(
                 Bucket=self.full_name,
                 Key=remote_file_path,
-                DestFilePath=local_file_path
+                DestFilePath=local_file_path,
+                PartSize=MULTIPART_PART_SIZE,
+                MAXThread=multipart_threads
             )
-            log.success(f'Download {file_name} to {local_file_path} success!')
             return True
         except Exception as e:
             log.error(f'Download {file_name} to {local_file_path} failed! '
                       f'detail: {e}, {format_exc()}')
             return False
 
-    def _delete_file(self, remote_dir, object_key):
-        """删除文件夹内的单个对象"""
-        if not remote_dir.endswith('/') and remote_dir != '':
-            remote_dir += '/'
-        if object_key not in self.list_dir_files(remote_dir):
-            err_msg = f'{object_key} not found in {remote_dir}'
-            log.error(err_msg)
-            return False, err_msg
-        else:
-            self._delete_object(remote_dir + object_key)
-            return True, ''
-
     def _delete_object(self, object_full_path: str):
         """删除指定路径对象"""
         log.warning(f'Bucket {self.name}, delete object: {object_full_path}')
@@ -128,6 +192,25 @@ class TencentCosBucket(object):
             Bucket=self.full_name,
             Key=object_full_path
         )
+        self.invalidate_cache(object_full_path)
+
+    def _delete_objects_batch(self, object_full_paths):
+        """批量删除对象，每次请求最多删除DELETE_BATCH_SIZE个，支持传入生成器，返回删除失败的对象列表"""
+        failed = []
+        object_full_paths = iter(object_full_paths)
+        while keys := list(islice(object_full_paths, DELETE_BATCH_SIZE)):
+            log.warning(f'Bucket {self.name}, delete {len(keys)} objects')
+            response = self.cos.client.delete_objects(
+                Bucket=self.full_name,
+                Delete={'Object': [{'Key': k} for k in keys], 'Quiet': 'true'}
+            )
+            # Quiet模式下响应中仅包含删除失败的对象
+            for err in response.get('Error', []):
+                log.error(f'Bucket {self.name}, delete object {err["Key"]} failed, '
+                          f'detail: {err.get("Code")}')
+                failed.append(err['Key'])
+        self.invalidate_cache()
+        return failed
 
     def _is_object_exists(self, object_full_path: str):
         return self.cos.client.object_exists(
@@ -135,36 +218,69 @@ class TencentCosBucket(object):
             Key=object_full_path
         )
 
+    def _fast_exists(self, object_full_path: str):
+        """通过MaxKeys=1的前缀列举判断对象是否存在，同名对象按字典序必然排在首位"""
+        object_key = self._fmt_object_key(object_full_path)
+        response = self.cos.client.list_objects(
+            Bucket=self.full_name, Prefix=object_key, MaxKeys=1)
+        return any(c['Key'] == object_key for c in response.get('Contents', []))
+
     def _get_object_md5hash(self, object_full_path: str):
         """获取文件md5哈希值 https://cloud.tencent.com/document/product/436/36427"""
         response = self._get_object_info(object_full_path)
         md5hash = response.get('x-cos-meta-md5')
-        log.debug(f'Bucket file: {object_full_path}, md5: {md5hash}')
+        log.debug('Bucket file: {}, md5: {}', object_full_path, md5hash)
         return md5hash
 
     def _get_object_info(self, object_full_path: str):
-        """获取对象元数据信息"""
-        return self.cos.client.get_object(
+        """获取对象元数据信息，使用HEAD请求不下载对象内容"""
+        return self.cos.client.head_object(
             Bucket=self.full_name,
             Key=object_full_path
         )
 
     def get_file_url(self, remote_file_path: str):
         """获取远程文件的url"""
-        if not self._is_object_exists(remote_file_path):
+        if not self._fast_exists(remote_file_path):
             log.error(f'{remote_file_path} not in bucket {self.name}')
             return ''
         else:
-            remote_dir, object_key = self._parse_object_path_name(remote_file_path)
+            remote_dir, object_key = self._parse_object_path_name(
+                self._fmt_object_key(remote_file_path))
             return self._get_object_url(remote_dir, object_key)
 
     def _get_object_url(self, remote_path: str, object_key: str):
         """获取指定对象的URL"""
-        object_url = self.base_url + quote(remote_path + '/' + object_key)
-        log.debug(f'get {remote_path + object_key} url: {object_url}')
+        object_dir = f'{remote_path}/' if remote_path else ''
+        object_url = f'{self.base_url}{self._quote(object_dir)}{self._quote(object_key)}'
+        log.debug('get {}{} url: {}', object_dir, object_key, object_url)
 
         return object_url
 
+    @staticmethod
+    def _fmt_object_key(object_full_path: str):
+        """与SDK一致，去掉对象路径开头的一个'/'"""
+        return object_full_path[1:] if object_full_path.startswith('/') else object_full_path
+
+    @staticmethod
+    def _fmt_dir_prefix(remote_dir: str):
+        """归一化文件夹路径为对象前缀形式，如 'a/b/'，根目录为 ''"""
+        if remote_dir in ['', '/']:
+            return ''
+        if remote_dir.startswith('/'):
+            remote_dir = remote_dir[1:]
+        if not remote_dir.endswith('/'):
+            remote_dir += '/'
+        return remote_dir
+
+    @staticmethod
+    def _check_duplicate_file_names(file_names: list, target_dir: str):
+        """批量传输前检查文件名是否重复，重名文件会并发写入同一目标而互相覆盖"""
+        duplicates = [n for n, count in Counter(file_names).items() if count > 1]
+        if duplicates:
+            raise ValueError(f'Duplicate file names would overwrite each other in '
+                             f'{target_dir}: {", ".join(sorted(duplicates))}')
+
     @staticmethod
     def _parse_object_path_name(object_full_path: str):
         """根据对象的全路径获取所在文件夹和文件名"""
@@ -180,20 +296,18 @@ class TencentCosBucket(object):
 
     def list_all_dirs(self):
         """列出所有远程文件夹"""
-        return [ob[:-1] for ob in self._list_objects() if ob.endswith('/')]
+        return [ob[:-1] for ob in self._iter_objects() if ob.endswith('/')]
 
     def list_all_files(self):
         """列出所有远程文件"""
-        return [ob for ob in self._list_objects() if not ob.endswith('/')]
+        return [ob for ob in self._iter_objects() if not ob.endswith('/')]
 
     def list_dir_files(self, remote_dir: str):
         """列出特定文件夹下远程文件"""
-        if remote_dir not in ['', '/']:
-            if remote_dir.startswith('/'):
-                remote_dir = remote_dir[1:]
-            if not remote_dir.endswith('/'):
-                remote_dir += '/'
-            if remote_dir[:-1] not in self.list_all_dirs():
+        remote_dir = self._fmt_dir_prefix(remote_dir)
+        if remote_dir != '':
+            parent_dir = remote_dir[:remote_dir[:-1].rfind('/') + 1]
+            if remote_dir not in self._list_prefixes(parent_dir):
                 raise CosBucketDirNotFoundError(f'Bucket dir {remote_dir} not found.')
         return self._list_objects(prefix=remote_dir)
 
@@ -207,12 +321,23 @@ class TencentCosBucket(object):
                 Body=b'',
                 Key=remote_dir_path
             )
+            self.invalidate_cache(remote_dir_path)
             log.success(f'Bucket {self.name} make dir {remote_dir_path} OK.')
             return True
         except Exception as e:
             log.error(f'Bucket {self.name} make dir {remote_dir_path} Failed. detail: {e}')
             return False
 
+    def invalidate_cache(self, remote_path: str = None):
+        """清除列举缓存，指定remote_path时仅清除包含该路径或位于该路径下的前缀缓存"""
+        if remote_path is None:
+            self._dircache.clear()
+            return
+        remote_path = self._fmt_object_key(remote_path)
+        for key in list(self._dircache):
+            if remote_path.startswith(key[0]) or key[0].startswith(remote_path):
+                self._dircache.pop(key, None)
+
     def upload_file(self, local_file_path: str, remote_dir: str = '', overwrite=True):
         """上传本地文件到远程指定文件夹"""
         result, msg = self._upload_object(local_file_path, remote_dir, overwrite)
@@ -221,36 +346,84 @@ class TencentCosBucket(object):
         return result
 
     def download_file(self, remote_file_path: str, local_dir: str):
-        """TODO: 此接口仅适合下载20MB以下的文件，待实现大文件续传"""
-        return self._download_object(remote_file_path, local_dir)
+        """下载远程文件到本地文件夹，大文件分块并发下载，中断后可续传"""
+        result = self._download_object(remote_file_path, local_dir)
+        if result:
+            log.success(f'Download {remote_file_path} to {local_dir} success!')
+        return result
+
+    def upload_files(self, local_file_paths: list, remote_dir: str = '',
+                     overwrite=True, workers: int = DEFAULT_WORKERS):
+        """并发上传多个本地文件到远程指定文件夹，按输入顺序返回各文件结果
+        文件间已经并发，大文件不再开启分块多线程，总连接数不超过workers"""
+        self._check_duplicate_file_names(
+            [os.path.basename(p) for p in local_file_paths], remote_dir)
+        remote_dir_prefix = self._fmt_dir_prefix(remote_dir)
+
+        def upload(local_file_path):
+            result, msg = self._upload_object_fast(
+                local_file_path, remote_dir_prefix, overwrite, multipart_threads=1)
+            if result is False:
+                log.error(f'Upload local file: {local_file_path} Failed, detail: {msg}')
+            return result
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(upload, local_file_paths))
+        log.success(f'Upload {sum(results)}/{len(results)} files to {remote_dir_prefix} Success!')
+        return results
+
+    def download_files(self, remote_file_paths: list, local_dir: str,
+                       workers: int = DEFAULT_WORKERS):
+        """并发下载多个远程文件到本地文件夹，按输入顺序返回各文件结果
+        文件间已经并发，大文件不再开启分块多线程，总连接数不超过workers"""
+        self._check_duplicate_file_names(
+            [self._parse_object_path_name(p)[1] for p in remote_file_paths], local_dir)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda p: self._download_object(p, local_dir, multipart_threads=1),
+                remote_file_paths))
+        log.success(f'Download {sum(results)}/{len(results)} files to {local_dir} success!')
+        return results
 
     def delete_file(self, remote_file_path: str):
-        """删除远程文件"""
-        if not self._is_object_exists(remote_file_path):
-            log.warning(f'{remote_file_path} not in bucket {self.name}')
+        """删除远程文件，文件不存在时同样视为删除成功"""
+        try:
+            self._delete_object(remote_file_path)
             return True
-        else:
-            remote_dir, object_key = self._parse_object_path_name(remote_file_path)
-            return self._delete_file(remote_dir, object_key)
+        except CosServiceError as e:
+            log.error(f'Delete {remote_file_path} failed, detail: {e.get_error_code()}')
+            return False
 
     def delete_dir_files(self, remote_dir: str):
-        """删除文件夹内所有对象"""
-        for file in self.list_dir_files(remote_dir):
-            self._delete_object(file)
+        """删除文件夹内所有对象，全部删除成功时返回True"""
+        prefix = self._fmt_dir_prefix(remote_dir)
+        failed = self._delete_objects_batch([prefix + f for f in self.list_dir_files(prefix)])
+        if failed:
+            log.error(f'Bucket {self.name} dir {prefix}: {len(failed)} objects delete failed')
+            return False
+        return True
 
     def delete_all_files(self):
-        """删除所有文件，清空存储桶"""
-        for obj in self._list_objects():
-            self._delete_object(obj)
+        """删除所有文件，清空存储桶，全部删除成功时返回True"""
+        failed = self._delete_objects_batch(self._iter_objects())
+        if failed:
+            log.error(f'Bucket {self.name}: {len(failed)} objects delete failed')
+            return False
         log.warning(f'Bucket {self.name} all files has been deleted')
+        return True
 
     def is_file_exists(self, remote_file_path: str):
         """判断远程文件是否存在"""
         return self._is_object_exists(remote_file_path)
 
+    def is_files_exists(self, remote_file_paths: list, workers: int = DEFAULT_WORKERS):
+        """并发判断多个远程文件是否存在，按输入顺序返回各文件结果"""
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self._is_object_exists, remote_file_paths))
+
     def get_file_md5(self, remote_file_path: str):
         """获取远程文件的MD5哈希值"""
-        if not self._is_object_exists(remote_file_path):
+        if not self._fast_exists(remote_file_path):
             log.error(f'{remote_file_path} not in bucket {self.name}')
             return ''
         else:
@@ -261,8 +434,19 @@ class TencentCosBucket(object):
         """获取本地文件的MD5哈希值"""
         if not os.path.isfile(local_file_path):
             raise FileNotFoundError(f'cannot found file: {local_file_path}')
-        with open(local_file_path, 'rb') as f:
+        return TencentCosBucket._local_file_md5(local_file_path).hexdigest()
+
+    @staticmethod
+    def _local_file_md5(local_file_path: str):
+        """读取一次本地文件，返回MD5哈希对象"""
+        with open(local_file_path, 'rb', buffering=0) as f:
+            # Linux下提示内核对本次打开的文件加大顺序预读，仅加速此处的哈希读取
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            # Python 3.11+ 由hashlib在C层完成读取和计算
+            if hasattr(hashlib, 'file_digest'):
+                return hashlib.file_digest(f, 'md5')
             md5hash = hashlib.md5()
-            for buffer in iter(partial(f.read, 128), b''):
+            for buffer in iter(partial(f.read, MD5_CHUNK_SIZE), b''):
                 md5hash.update(buffer)
-            return md5hash.hexdigest()
+            return md5hash